@@ -1,22 +1,53 @@
-from collections.abc import Generator, Iterable
-from dataclasses import dataclass, field, asdict
+import asyncio
+from collections.abc import AsyncGenerator, Callable, Generator, Iterable
+from dataclasses import dataclass, field, fields
 from datetime import date, datetime, timedelta, timezone
+import hashlib
 import itertools
-import json
-import json as jsonmodule
 from os import getenv
+from pathlib import Path
 import re
+import sys
+import tempfile
+import time
 from typing import Any, Literal
-from urllib.parse import urlsplit
-from xml.etree import ElementTree
+from urllib.parse import unquote, urlsplit
 import httpx
 from httpx_retries import Retry, RetryTransport
+from lxml import etree
+import orjson
 
 
+NOTION_API_KEY = getenv('NOTION_API_KEY', '')
 NOTION_RULE_DATABASE = getenv('NOTION_RULE_DATABASE', '')
-
-
-@dataclass
+REGULATIONS_GOV_API_KEY = getenv('REGULATIONS_GOV_API_KEY', '')
+# Set RULE_SCOUT_CACHE=1 to cache responses that never change (e.g. published
+# Federal Register documents) on disk and reuse them on later runs. They are
+# kept in RULE_SCOUT_CACHE_DIR, if set, or ~/.cache/rule-scout.
+CACHE_DIR = (
+    getenv('RULE_SCOUT_CACHE_DIR') or str(Path.home() / '.cache' / 'rule-scout')
+    if getenv('RULE_SCOUT_CACHE') == '1' or getenv('RULE_SCOUT_CACHE_DIR')
+    else None
+)
+
+# If true, prints the data collected for each new rule before adding it to
+# Notion.
+PRINT_RULE_DATA = True
+
+# How many rules to gather data for at once.
+RULE_CONCURRENCY = 16
+
+# Patterns used for every rule we process, compiled once up front.
+FR_DOCUMENT_PATH_PATTERN = re.compile(r'^/api/v1/documents/(\d{4}-\d+)/?$')
+MARKUP_TAG_PATTERN = re.compile(r'</?\w+[^>]*>')
+KEYWORD_SEPARATOR_PATTERN = re.compile(r',\s+')
+
+# Connection pool settings for API clients. Each client talks to a single
+# host, so this is plenty.
+DEFAULT_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0)
+
+
+@dataclass(slots=True)
 class FrAgency:
     id: int
     name: str
@@ -26,7 +57,7 @@ class FrAgency:
     fr_slug: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Docket:
     id: str
     title: str
@@ -59,7 +90,7 @@ class Docket:
         # uses comma-separated numbers to describe chains of carbons, e.g.
         # "(Z)-1-Chloro-2,3,3,3,-Tetrafluoropropene".
         if len(keywords) == 1 and ', ' in keywords[0]:
-            keywords = re.split(r',\s+', keywords[0])
+            keywords = KEYWORD_SEPARATOR_PATTERN.split(keywords[0])
 
         return Docket(
             id=docket_id,
@@ -69,7 +100,7 @@ class Docket:
             # TODO: the comma substitution here is because Notion can't handle
             # commas in select box items. This should probably happen when
             # formatting Notion input and not here.
-            keywords=[re.sub(r',', ";", term) for term in keywords],
+            keywords=[term.replace(',', ';') for term in keywords],
             rin=rin,
             subtypes=[
                 x
@@ -80,7 +111,7 @@ class Docket:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class DocketDocument:
     id: str
     url: str
@@ -91,7 +122,7 @@ class DocketDocument:
     subtype: str = ''
 
 
-@dataclass
+@dataclass(slots=True)
 class ProposedRule:
     title: str
     abstract: str | None
@@ -111,17 +142,178 @@ class ProposedRule:
     docket_documents: list[DocketDocument] = field(default_factory=list)
 
 
-class HttpClient(httpx.Client):
-    def __init__(self, timeout: float = 10.0, transport: Any = None, **kwargs):
-        super().__init__(
-            timeout=timeout,
-            transport=(transport or RetryTransport(retry=Retry(total=5, backoff_factor=1.0))),
-            **kwargs,
-        )
+class ResponseCacheTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps another transport and caches successful GET responses on disk, keyed
+    by URL. Only URLs matching ``cacheable`` are cached, and cached responses
+    never expire, so it should only match URLs whose content does not change.
+    If some of those responses might still change, ``is_final`` is called with
+    the URL and body, and the response is only cached if it returns true.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        cache_dir: str | Path,
+        cacheable: re.Pattern,
+        is_final: Callable[[str, bytes], bool] | None = None,
+    ):
+        self.transport = transport
+        self.cache_dir = Path(cache_dir)
+        self.cacheable = cacheable
+        self.is_final = is_final
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if request.method != 'GET' or not self.cacheable.match(url):
+            return await self.transport.handle_async_request(request)
+
+        # Full text XML can be several megabytes, so don't block the event
+        # loop on disk access.
+        cache_file = self.cache_dir / hashlib.sha256(url.encode()).hexdigest()
+        cached = await asyncio.to_thread(self._read, cache_file)
+        if cached is not None:
+            return httpx.Response(200, content=cached, request=request)
+
+        response = await self.transport.handle_async_request(request)
+        if response.status_code != 200:
+            return response
+
+        # This is the decoded body, so the new response should not carry over
+        # the original's content-encoding header.
+        content = await response.aread()
+        if not self.is_final or self.is_final(url, content):
+            await asyncio.to_thread(self._write, cache_file, content)
+        return httpx.Response(200, content=content, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    @staticmethod
+    def _read(cache_file: Path) -> bytes | None:
+        try:
+            return cache_file.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, cache_file: Path, content: bytes) -> None:
+        # Cached files are never checked again, so write to a temporary file
+        # and move it into place. That way, a partial write (e.g. if we are
+        # killed or run out of disk space) never looks like a valid entry.
+        temp_file = tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix='.tmp-', delete=False)
+        temp_path = Path(temp_file.name)
+        try:
+            with temp_file:
+                temp_file.write(content)
+            temp_path.replace(cache_file)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+
+def parse_json(response: httpx.Response) -> Any:
+    """
+    Parse a response body as JSON. This is faster than ``response.json()``,
+    which matters for the large documents some of these APIs return.
+    """
+    return orjson.loads(response.content)
+
+
+class AsyncTokenBucket:
+    """
+    Rate limiter for async code. Tokens accumulate at ``rate`` per second, up
+    to ``capacity``, and each call to ``acquire()`` waits for and uses one.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HttpClient(httpx.AsyncClient):
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        transport: Any = None,
+        http2: bool = True,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+        retry: Retry | None = None,
+        cache_dir: str | None = None,
+        cacheable: re.Pattern | None = None,
+        cache_is_final: Callable[[str, bytes], bool] | None = None,
+        rate_limit: AsyncTokenBucket | None = None,
+        max_concurrency: int | None = None,
+        **kwargs,
+    ):
+        self.rate_limit = rate_limit
+        # Caps how many requests can be waiting on this API at once, no matter
+        # how many tasks are sharing the client.
+        self.concurrency = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        if not transport:
+            # Connection options only apply to the default transport, so they
+            # need to be set on the transport that RetryTransport wraps.
+            transport = RetryTransport(
+                transport=httpx.AsyncHTTPTransport(http2=http2, limits=limits),
+                # By default, this retries idempotent requests on 429, 500,
+                # 502, 503, and 504 responses and on network errors, with
+                # jittered exponential backoff that respects `Retry-After`
+                # headers. Only idempotent methods (GET, PUT, DELETE, etc.) are
+                # retried, so repeating one after a 500, which is often just a
+                # transient failure, can't cause duplicate changes.
+                retry=(retry or Retry(
+                    total=5,
+                    backoff_factor=1.0,
+                    max_backoff_wait=60.0,
+                    status_forcelist=[*Retry.RETRYABLE_STATUS_CODES, 500],
+                )),
+            )
+            if cache_dir and cacheable:
+                transport = ResponseCacheTransport(transport, cache_dir, cacheable, cache_is_final)
+
+        super().__init__(timeout=timeout, transport=transport, **kwargs)
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if not self.concurrency:
+            return await self._send_limited(request, **kwargs)
+
+        async with self.concurrency:
+            return await self._send_limited(request, **kwargs)
+
+    async def _send_limited(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if self.rate_limit:
+            await self.rate_limit.acquire()
+
+        return await super().send(request, **kwargs)
 
 
 class NotionApi(HttpClient):
     BASE_URL = 'https://api.notion.com/v1'
+    # Requests that change something (inserts and updates) are only retried
+    # when we know Notion didn't act on them, so we don't insert duplicates.
+    WRITE_RETRY = Retry(
+        total=5,
+        backoff_factor=1.0,
+        max_backoff_wait=60.0,
+        allowed_methods=['POST', 'PATCH', 'DELETE'],
+        status_forcelist=[429, 503],
+        retry_on_exceptions=[httpx.ConnectError, httpx.ConnectTimeout],
+    )
 
     def __init__(self, api_key):
         if not isinstance(api_key, str):
@@ -135,9 +327,32 @@ class NotionApi(HttpClient):
                 'Content-Type': 'application/json',
             },
             timeout=15.0,
+            # Notion allows an average of 3 requests/second, so we never need
+            # a big connection pool.
+            # https://developers.notion.com/reference/request-limits
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20),
+            rate_limit=AsyncTokenBucket(rate=3, capacity=3),
+            max_concurrency=5,
+            # Queries are POST requests, but only read data, so they can be
+            # retried like any other read. See `build_request()` for writes.
+            retry=Retry(
+                total=5,
+                backoff_factor=1.0,
+                max_backoff_wait=60.0,
+                allowed_methods=[*Retry.RETRYABLE_METHODS, 'POST'],
+                status_forcelist=[*Retry.RETRYABLE_STATUS_CODES, 500],
+            ),
         )
 
-    def json(
+    def build_request(self, method: str, url: httpx.URL | str, **kwargs) -> httpx.Request:
+        request = super().build_request(method, url, **kwargs)
+        # RetryTransport uses the policy in this extension instead of its own.
+        if request.method != 'GET' and not request.url.path.endswith('/query'):
+            request.extensions['retry'] = self.WRITE_RETRY
+
+        return request
+
+    async def json(
         self,
         method: str,
         url: str,
@@ -146,71 +361,114 @@ class NotionApi(HttpClient):
         params: Any = None,
         headers: dict | None = None,
     ) -> dict | list:
-        response = self.request(method, url, json=json, params=params, headers=headers)
-        body = response.json()
+        response = await self.request(
+            method,
+            url,
+            content=None if json is None else orjson.dumps(json),
+            params=params,
+            headers=headers,
+        )
+        body = parse_json(response)
         if not response.is_success:
-            raise ValueError(f'Error for Notion {method} {url}: {jsonmodule.dumps(body, indent=2)}')
+            raise ValueError(f'Error for Notion {method} {url}: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()}')
 
         return body
 
-    def query_db(self, data_source_id: str, filter: dict | None = None, select: list[str] = [], sort: dict[str, str] = {}) -> Generator[dict, None, None]:
-        body = {}
+    async def query_db(self, data_source_id: str, filter: dict | None = None, select: list[str] = [], sort: dict[str, str] = {}) -> AsyncGenerator[dict, None]:
+        # 100 is the maximum page size Notion allows.
+        body: dict[str, Any] = {'page_size': 100}
+        # The filter and sort are the same for every page, so serialize them
+        # once instead of every time we request the next page.
         if filter:
-            body['filter'] = filter
+            body['filter'] = orjson.Fragment(orjson.dumps(filter))
         if sort:
-            body['sorts'] = [
+            body['sorts'] = orjson.Fragment(orjson.dumps([
                 dict(property=key, direction=value)
                 for key, value in sort.items()
-            ]
+            ]))
         params = {}
         if select:
-            params['filter_properties[]'] = select
+            params['filter_properties'] = await self.get_property_ids(data_source_id, select)
 
-        while True:
-            data = self.json(
+        async def get_page(body: dict) -> dict:
+            data = await self.json(
                 'POST',
                 url=f'/data_sources/{data_source_id}/query',
                 params=params,
                 json=body,
             )
             assert isinstance(data, dict)
+            return data
 
-            yield from data['results']
+        # Start loading the next page before yielding the current one, so it
+        # is (hopefully) ready by the time the caller gets to it.
+        next_page: asyncio.Task[dict] | None = asyncio.create_task(get_page(body))
+        try:
+            while next_page:
+                data = await next_page
+                if data.get('has_more', False):
+                    body = {**body, 'start_cursor': data.get('next_cursor')}
+                    next_page = asyncio.create_task(get_page(body))
+                else:
+                    next_page = None
 
-            if data.get('has_more', False):
-                body = {**body, 'start_cursor': data.get('next_cursor')}
-            else:
-                break
+                for result in data['results']:
+                    yield result
+        finally:
+            if next_page:
+                next_page.cancel()
 
-    def insert_into_db(self, data_source_id: str, page_data: dict) -> Any:
-        response = self.post(
+    async def get_property_ids(self, data_source_id: str, names: Iterable[str]) -> list[str]:
+        """
+        Get the IDs of the named properties in a data source. Some parts of
+        the API (e.g. ``filter_properties`` in queries) only accept IDs.
+        """
+        data_source = await self.json('GET', f'/data_sources/{data_source_id}')
+        assert isinstance(data_source, dict)
+        properties = data_source['properties']
+
+        ids = []
+        for name in names:
+            if name not in properties:
+                raise ValueError(f'Notion data source {data_source_id} has no property named "{name}"')
+            # IDs come already URL-encoded, but httpx will encode them again
+            # when they are used as query parameters.
+            ids.append(unquote(properties[name]['id']))
+
+        return ids
+
+    async def insert_into_db(self, data_source_id: str, page_data: dict) -> Any:
+        # Page data can be big, so serialize it with orjson. The content type
+        # header is already set on the client.
+        response = await self.post(
             url='/pages',
-            json={
+            content=orjson.dumps({
                 'parent': {
                     'type': 'data_source_id',
                     'data_source_id': data_source_id,
                 },
                 'properties': page_data,
-            },
+            }),
         )
 
-        body = response.json()
+        body = parse_json(response)
         if not response.is_success:
-            raise ValueError(f'Error inserting into Notion DB: {json.dumps(body, indent=2)}')
+            raise ValueError(f'Error inserting into Notion DB: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()}')
 
         return body
 
-    def get_page(self, page_id: str) -> Any:
-        return self.json('GET', f'/pages/{page_id}')
+    async def get_page(self, page_id: str) -> Any:
+        return await self.json('GET', f'/pages/{page_id}')
 
-    def get_page_content(self, page_id: str) -> Any:
+    async def get_page_content(self, page_id: str) -> Any:
         content = []
         next_options = {
             'url': f'/blocks/{page_id}/children',
             'params': {}
         }
         while next_options:
-            data = self.get(**next_options).raise_for_status().json()
+            response = await self.get(**next_options)
+            data = parse_json(response.raise_for_status())
             content.extend(data['results'])
             if data['next_cursor']:
                 next_options = {
@@ -222,32 +480,32 @@ class NotionApi(HttpClient):
 
         return content
 
-    def update_page(self, page_id: str, properties: dict) -> Any:
-        response = self.patch(
+    async def update_page(self, page_id: str, properties: dict) -> Any:
+        response = await self.patch(
             url=f'/pages/{page_id}',
-            json={'properties': properties}
+            content=orjson.dumps({'properties': properties})
         )
 
-        body = response.json()
+        body = parse_json(response)
         if not response.is_success:
-            raise ValueError(f'Error updating page {page_id}: {json.dumps(body, indent=2)}')
+            raise ValueError(f'Error updating page {page_id}: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()}')
 
         return body
 
-    def trash_page(self, page_id: str) -> Any:
-        response = self.patch(
+    async def trash_page(self, page_id: str) -> Any:
+        response = await self.patch(
             url=f'/pages/{page_id}',
-            json={'in_trash': True}
+            content=orjson.dumps({'in_trash': True})
         )
 
-        body = response.json()
+        body = parse_json(response)
         if not response.is_success:
-            raise ValueError(f'Error trashing page {page_id}: {json.dumps(body, indent=2)}')
+            raise ValueError(f'Error trashing page {page_id}: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()}')
 
         return body
 
-    def append_page_content(self, page_id: str, children: list[dict], after: str|None) -> Any:
-        return self.json(
+    async def append_page_content(self, page_id: str, children: list[dict], after: str|None) -> Any:
+        return await self.json(
             'PATCH',
             url=f'/blocks/{page_id}/children',
             json={'children': children, 'after': after}
@@ -270,8 +528,10 @@ class NotionApi(HttpClient):
         notion_value = cell['date']
         if notion_value:
             result = datetime.fromisoformat(notion_value['start'])
+            # Treat dates without a time zone (including date-only values) as
+            # UTC. (`astimezone()` would treat them as local time instead.)
             if not result.tzinfo:
-                result = result.astimezone(timezone.utc)
+                result = result.replace(tzinfo=timezone.utc)
 
             return result
         else:
@@ -280,68 +540,159 @@ class NotionApi(HttpClient):
 
 class FederalRegisterApi(HttpClient):
     BASE_URL = 'https://www.federalregister.gov/api/v1'
+    # Individual documents and their full text don't change once published.
+    # (Search results obviously do, so they should never be cached.)
+    CACHEABLE_URLS = re.compile(
+        r'^https://www\.federalregister\.gov/('
+        r'api/v1/documents/[\w-]+(\.json)?'
+        r'|documents/full_text/xml/[\w/-]+\.xml'
+        r')$'
+    )
+    # Full text URLs include the publication date, e.g.
+    # /documents/full_text/xml/2024/11/05/2024-25000.xml
+    FULL_TEXT_DATE_PATTERN = re.compile(r'/full_text/xml/(\d{4})/(\d{2})/(\d{2})/')
+
+    def __init__(self, cache_dir: str | None = None):
+        super().__init__(
+            base_url=self.BASE_URL,
+            cache_dir=cache_dir,
+            cacheable=self.CACHEABLE_URLS,
+            cache_is_final=self._is_final,
+            max_concurrency=8,
+        )
+
+    @classmethod
+    def _is_final(cls, url: str, content: bytes) -> bool:
+        """
+        Documents are sometimes still being updated on the day they are
+        published, so only treat them as final once they're a day old.
+        """
+        date_match = cls.FULL_TEXT_DATE_PATTERN.search(url)
+        if date_match:
+            published = date(*(int(part) for part in date_match.groups()))
+        else:
+            try:
+                published = date.fromisoformat(orjson.loads(content)['publication_date'])
+            except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+                return False
 
-    def __init__(self):
-        super().__init__(base_url=self.BASE_URL)
+        return published <= date.today() - timedelta(days=1)
 
-    def get_document(self, document_id) -> dict:
-        return self.get(url=f'/documents/{document_id}').raise_for_status().json()
+    async def get_document(self, document_id) -> dict:
+        response = await self.get(url=f'/documents/{document_id}')
+        return parse_json(response.raise_for_status())
 
-    def get_recent_proposed_rules(self, from_date: date | None = None, to_date: date | None = None) -> Generator[dict]:
+    async def get_recent_proposed_rules(self, from_date: date | None = None, to_date: date | None = None) -> AsyncGenerator[dict]:
         params = {
             'order': 'oldest',
             'conditions[type][]': 'PRORULE',
+            # The largest page size the API allows.
+            'per_page': 1000,
         }
         if from_date:
             params['conditions[publication_date][gte]'] = from_date.isoformat()
         if to_date:
             params['conditions[publication_date][lte]'] = to_date.isoformat()
-        next_options = {
-            'url': '/documents',
-            'params': params
-        }
-        while next_options:
-            page = self.get(**next_options).raise_for_status().json()
-            yield from page.get('results') or []
 
-            next_url = page.get('next_page_url')
-            next_options = {'url': next_url} if next_url else None
+        async def get_page(page_number: int) -> dict:
+            response = await self.get(url='/documents', params={**params, 'page': page_number})
+            return parse_json(response.raise_for_status())
 
-    def get_rule_authority(self, rule_info) -> list[str]:
+        # The first page tells us how many there are, so fetch the rest all at
+        # once instead of following `next_page_url` one at a time.
+        first_page = await get_page(1)
+        other_pages = await asyncio.gather(
+            *(get_page(number) for number in range(2, (first_page.get('total_pages') or 1) + 1))
+        )
+        for page in (first_page, *other_pages):
+            for result in page.get('results') or []:
+                yield result
+
+    async def get_rule_authority(self, rule_info) -> list[str]:
         xml_url = rule_info['full_text_xml_url']
         if not xml_url:
             return []
 
-        gpo_xml = self.get(xml_url).raise_for_status().text
-        root = ElementTree.fromstring(gpo_xml)
+        # GPO XML for a rule can be several megabytes, so parse it as it
+        # downloads instead of building the whole tree. We only read a few
+        # elements, so there's no need to build an ID lookup table.
+        parser = etree.XMLPullParser(events=('end',), collect_ids=False)
+        auth_texts = []
+        async with self.stream('GET', xml_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+                auth_texts.extend(self._read_auth_texts(parser))
+
+        parser.close()
+        auth_texts.extend(self._read_auth_texts(parser))
 
-        # Find all <AUTH> elements and extract paragraph content (they usually
-        # also contain a heading).
-        auth_texts = (auth.text
-                      for auth in root.findall('.//AUTH/P')
-                      if auth.text is not None)
         return [item.strip()
                 for text in auth_texts
                 for item in text.split(';')]
 
+    @staticmethod
+    def _read_auth_texts(parser: etree.XMLPullParser) -> Generator[str]:
+        """
+        Yield the text of any ``<AUTH><P>`` elements that ``parser`` has
+        finished parsing, discarding everything else as it goes.
+        """
+        for _event, element in parser.read_events():
+            # <AUTH> elements usually contain a heading as well as paragraphs;
+            # we only want the paragraph content.
+            if element.tag == 'P' and element.text is not None:
+                parent = element.getparent()
+                if parent is not None and parent.tag == 'AUTH':
+                    yield element.text
+
+            # Drop elements we're done with so memory use stays flat.
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
 
 class RegulationsGovApi(HttpClient):
     BASE_URL = 'https://api.regulations.gov/v4'
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, rate_limit: AsyncTokenBucket | None = None):
         if not isinstance(api_key, str):
             raise TypeError('api_key must be a string')
 
         super().__init__(
             base_url=self.BASE_URL,
             headers={'X-Api-Key': api_key},
+            rate_limit=rate_limit,
+            # Each rule can fan out to many document and docket lookups, so
+            # keep the total in flight modest.
+            max_concurrency=8,
         )
-
-    def get_docket(self, docket_id: str) -> dict:
-        response = self.get(url=f'/dockets/{docket_id}')
-        return response.raise_for_status().json()['data']
-
-    def get_docket_object(self, docket_id: str, if_missing: Literal['raise', 'hidden'] = 'raise') -> Docket:
+        # Documents (even for different rules) often share a docket, so keep
+        # the results around. This holds futures rather than results so that
+        # callers asking for the same docket at the same time share a request.
+        self._docket_cache: dict[str, asyncio.Future[dict]] = {}
+
+    async def get_docket(self, docket_id: str) -> dict:
+        if docket_id not in self._docket_cache:
+            future = asyncio.ensure_future(self._fetch_docket(docket_id))
+            future.add_done_callback(lambda future: self._forget_failed_docket(docket_id, future))
+            self._docket_cache[docket_id] = future
+
+        return await self._docket_cache[docket_id]
+
+    def _forget_failed_docket(self, docket_id: str, future: asyncio.Future[dict]) -> None:
+        # Keep "not found" responses, but let other failures be retried.
+        error = None if future.cancelled() else future.exception()
+        not_found = isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 404
+        if (future.cancelled() or (error and not not_found)) and self._docket_cache.get(docket_id) is future:
+            del self._docket_cache[docket_id]
+
+    async def _fetch_docket(self, docket_id: str) -> dict:
+        response = await self.get(url=f'/dockets/{docket_id}')
+        return parse_json(response.raise_for_status())['data']
+
+    async def get_docket_object(self, docket_id: str, if_missing: Literal['raise', 'hidden'] = 'raise') -> Docket:
         """
         Get a parsed ``Docket`` object representing the docket. If no docket
         is found with the given ID, ``if_missing`` controls the result. If it
@@ -349,7 +700,7 @@ class RegulationsGovApi(HttpClient):
         ``'hidden'`` this will return a "hidden" Docket object with no data.
         """
         try:
-            return Docket.from_api(self.get_docket(docket_id))
+            return Docket.from_api(await self.get_docket(docket_id))
         except httpx.HTTPStatusError as error:
             if if_missing == 'hidden' and error.response.status_code == 404:
                 return Docket(
@@ -361,49 +712,124 @@ class RegulationsGovApi(HttpClient):
             else:
                 raise
 
-    def get_document(self, document_id) -> dict:
-        response = self.get(url=f'/documents/{document_id}')
-        return response.raise_for_status().json()['data']
+    async def get_document(self, document_id) -> dict:
+        response = await self.get(url=f'/documents/{document_id}')
+        return parse_json(response.raise_for_status())['data']
 
-    def find_documents_by_register_id(self, register_id) -> list[dict]:
-        results = self.get(
+    async def find_documents_by_register_id(self, register_id) -> list[dict]:
+        response = await self.get(
             url='/documents',
             params={'filter[frDocNum]': register_id}
-        ).raise_for_status().json()
+        )
+        results = parse_json(response.raise_for_status())
 
         return results['data']
 
 
-def main() -> None:
+def check_environment() -> None:
+    """Exit with an error if any required environment variables are missing."""
+    missing = [
+        name
+        for name, value in (
+            ('NOTION_API_KEY', NOTION_API_KEY),
+            ('NOTION_RULE_DATABASE', NOTION_RULE_DATABASE),
+            ('REGULATIONS_GOV_API_KEY', REGULATIONS_GOV_API_KEY),
+        )
+        if not value
+    ]
+    if missing:
+        sys.exit(f'Missing required environment variables: {', '.join(missing)}')
+
+
+async def main() -> None:
+    check_environment()
     timeframe = timedelta(days=2)
     from_date = date.today() - timeframe
 
-    with NotionApi(getenv('NOTION_API_KEY')) as notion:
+    async with NotionApi(NOTION_API_KEY) as notion:
+        # We only look at rules published since `from_date`, so there's no
+        # need to read older ones (with a little margin, just in case).
         rule_rows = notion.query_db(
             NOTION_RULE_DATABASE,
             {
-                'property': 'FR Document Number',
-                'rich_text': {
-                    'is_not_empty': True
-                }
-            }
+                'and': [
+                    {
+                        'property': 'FR Document Number',
+                        'rich_text': {
+                            'is_not_empty': True
+                        }
+                    },
+                    {
+                        'property': 'FR Publication Date',
+                        'date': {
+                            'on_or_after': (from_date - timedelta(days=7)).isoformat()
+                        }
+                    },
+                ]
+            },
+            # We only need one property, so don't ask for (or parse) the rest.
+            select=['FR Document Number'],
         )
 
-        already_in_notion = set(notion.cell_as_text(row['properties']['FR Document Number'])
-                                for row in rule_rows)
+        already_in_notion = {
+            NotionApi.cell_as_text(row['properties']['FR Document Number'])
+            async for row in rule_rows
+        }
+
+        async with (
+            FederalRegisterApi(cache_dir=CACHE_DIR) as register,
+            RegulationsGovApi(REGULATIONS_GOV_API_KEY) as regulations_gov,
+        ):
+            async def get_docket_documents(register_id: str) -> list[DocketDocument]:
+                summaries = await regulations_gov.find_documents_by_register_id(register_id)
+                document_infos = await asyncio.gather(
+                    *(regulations_gov.get_document(summary['id']) for summary in summaries)
+                )
+
+                # Not all documents belong to [visible] dockets! Usually this
+                # is because an agency (e.g. FCC) does not use regulations.gov
+                # (often because they have their own public comment system).
+                # It seems the proposed rules get posted somehow to
+                # regulations.gov, but are added to a special docket that is
+                # not visible to public users, and that was probably
+                # automatically created.
+                docket_ids = list({
+                    info['attributes']['docketId']
+                    for info in document_infos
+                    if info['attributes']['docketId']
+                })
+                dockets_by_id = dict(zip(
+                    docket_ids,
+                    await asyncio.gather(*(
+                        regulations_gov.get_docket_object(docket_id, if_missing='hidden')
+                        for docket_id in docket_ids
+                    ))
+                ))
+
+                documents = []
+                for summary, document_info in zip(summaries, document_infos):
+                    regs_gov_id = summary['id']
+                    comment_start_iso = document_info['attributes']['commentStartDate']
+                    comment_end_iso = document_info['attributes']['commentEndDate']
+                    docket_id = document_info['attributes']['docketId']
+                    documents.append(DocketDocument(
+                        id=regs_gov_id,
+                        url=f'https://www.regulations.gov/document/{regs_gov_id}',
+                        comment_start_date=comment_start_iso and datetime.fromisoformat(comment_start_iso),
+                        comment_end_date=comment_end_iso and datetime.fromisoformat(comment_end_iso),
+                        docket=dockets_by_id[docket_id] if docket_id else None,
+                    ))
+
+                return documents
 
-    # TODO: consider how to better implement this. The easy thing is to put
-    # @lru_cache on the RegulationsGovApi.get_docket method, but that could
-    # introduce problems if the way we use it changes.
-    docket_cache: dict[str, Docket] = {}
-    with FederalRegisterApi() as register:
-        with RegulationsGovApi(getenv(key='REGULATIONS_GOV_API_KEY')) as regulations_gov:
-            for rule in register.get_recent_proposed_rules(from_date=from_date):
+            async def process_rule(rule: dict) -> dict:
+                """
+                Gather data about a rule and format it as properties for a new
+                page in the Notion database.
+                """
                 register_id = rule['document_number']
-                if register_id in already_in_notion:
-                    continue
 
-                rule_info = register.get_document(register_id)
+                rule_info = await register.get_document(register_id)
                 correction_of = None
                 # TODO: check if correction and update existing record instead
                 # of skipping. This will be a URL, so we have to parse, e.g:
@@ -414,22 +840,32 @@ def main() -> None:
                     if correction_url.hostname != 'www.federalregister.gov':
                         raise ValueError(f'FR document {register_id} had invalid `correction_of` host: "{correction_of_raw}"')
 
-                    path_match = re.match(r'^/api/v1/documents/(\d{4}-\d+)/?$', correction_url.path)
+                    path_match = FR_DOCUMENT_PATH_PATTERN.match(correction_url.path)
                     if not path_match:
                         raise ValueError(f'FR document {register_id} had invalid `correction_of` path: "{correction_of_raw}"')
 
                     correction_of = path_match.group(1)
 
-                authority = register.get_rule_authority(rule_info)
+                # Getting the authority means downloading the rule's full text,
+                # which is slow, so do it while looking up the rule on
+                # regulations.gov.
+                authority, docket_documents = await asyncio.gather(
+                    register.get_rule_authority(rule_info),
+                    get_docket_documents(register_id),
+                )
+
+                # Sometimes there is markup in the abstract. Mainly I've seen
+                # <inf> (or <E T="52">, which is the same but in GPO XML) for
+                # subscript. I don't think there's a good way to mark that up
+                # in Notion (maybe as an equation?) for now, so just rip out
+                # the markup. Most abstracts have none, so skip the regex then.
+                abstract = rule_info['abstract'] or ''
+                if '<' in abstract:
+                    abstract = MARKUP_TAG_PATTERN.sub('', abstract)
 
                 data = ProposedRule(
                     title=rule_info['title'],
-                    # Sometimes there is markup in here. Mainly I've seen <inf>
-                    # (or <E T="52">, which is the same but in GPO XML) for
-                    # subscript. I don't think there's a good way to mark that
-                    # up in Notion (maybe as an equation?) for now, so just rip
-                    # out the markup.
-                    abstract=re.sub(r'</?\w+[^>]*>', '', rule_info['abstract'] or ''),
+                    abstract=abstract,
                     action=rule_info['action'],
                     agencies=[
                         FrAgency(id=agency['id'], name=agency['name'])
@@ -456,60 +892,34 @@ def main() -> None:
                         date.fromisoformat(rule_info['comments_close_on'])
                         if rule_info['comments_close_on']
                         else None
-                    )
+                    ),
+                    docket_documents=docket_documents,
                 )
 
-                for summary in regulations_gov.find_documents_by_register_id(register_id):
-                    regs_gov_id = summary['id']
-                    document_info = regulations_gov.get_document(regs_gov_id)
-
-                    comment_start_iso = document_info['attributes']['commentStartDate']
-                    comment_end_iso = document_info['attributes']['commentEndDate']
-                    document = DocketDocument(
-                        id=regs_gov_id,
-                        url=f'https://www.regulations.gov/document/{regs_gov_id}',
-                        comment_start_date=comment_start_iso and datetime.fromisoformat(comment_start_iso),
-                        comment_end_date=comment_end_iso and datetime.fromisoformat(comment_end_iso),
-                    )
-                    data.docket_documents.append(document)
-
-                    # Not all documents belong to [visible] dockets! Usually
-                    # this is because an agency (e.g. FCC) does not use
-                    # regulations.gov (often because they have their own
-                    # public comment system). It seems the proposed rules get
-                    # posted somehow to regulations.gov, but are added to a
-                    # special docket that is not visible to public users, and
-                    # that was probably automatically created.
-                    docket_id = document_info['attributes']['docketId']
-                    if docket_id:
-                        docket = docket_cache.get(docket_id)
-                        if not docket:
-                            docket = regulations_gov.get_docket_object(docket_id, if_missing='hidden')
-                            docket_cache[docket_id] = docket
-
-                        document.docket = docket
-                        if document.docket.rin and document.docket.rin not in data.rins:
-                            data.rins.append(document.docket.rin)
-
-                print('\nRule Data:')
-                for k, v in asdict(data).items():
-                    if k != 'docket_documents':
-                        print(f'  {k.ljust(25, '.')} {v}')
-                print('  docket_documents:')
+                known_rins = set(data.rins)
                 for document in data.docket_documents:
-                    print('    -')
-                    for k, v in asdict(document).items():
-                        print(f'    {k.ljust(23, '.')} {v}')
-
-                comment_end: datetime | date | None = None
-                commentable: list[DocketDocument] = sorted(
-                    (d for d in data.docket_documents if d.comment_end_date),
-                    key=lambda d: d.comment_end_date
+                    rin = document.docket and document.docket.rin
+                    if rin and rin not in known_rins:
+                        known_rins.add(rin)
+                        data.rins.append(rin)
+
+                if PRINT_RULE_DATA:
+                    print('\nRule Data:')
+                    for f in fields(data):
+                        if f.name != 'docket_documents':
+                            print(f'  {f.name.ljust(25, '.')} {getattr(data, f.name)}')
+                    print('  docket_documents:')
+                    for document in data.docket_documents:
+                        print('    -')
+                        for f in fields(document):
+                            print(f'    {f.name.ljust(23, '.')} {getattr(document, f.name)}')
+
+                # Prefer the latest deadline from regulations.gov, which is
+                # more detailed than the Federal Register's.
+                comment_end: datetime | date | None = max(
+                    (d.comment_end_date for d in data.docket_documents if d.comment_end_date),
+                    default=data.comment_end_date
                 )
-                if len(commentable):
-                    comment_end = commentable[-1].comment_end_date
-                else:
-                    comment_end = data.comment_end_date
 
                 # Notion can't take text segments of more than 2k characters.
                 # https://developers.notion.com/reference/request-limits#limits-for-property-values
@@ -523,12 +933,12 @@ def main() -> None:
                     authority_string = authority_string[:1999] + '…'
 
                 # Dedupe when multiple dockets use the same keywords.
-                keywords = sorted(set(
+                keywords = sorted({
                     keyword
                     for document in data.docket_documents
                     if document.docket
                     for keyword in document.docket.keywords
-                ))
+                })
 
                 # TODO: consider making Docket objects hashable so we can just
                 # put them in a set.
@@ -539,119 +949,140 @@ def main() -> None:
                         dockets.append(document.docket)
                         seen_dockets.add(document.docket.id)
 
-                with NotionApi(getenv('NOTION_API_KEY')) as notion:
-                    notion.insert_into_db(NOTION_RULE_DATABASE, {
-                        # Corrections are now relations and need to be
-                        # formatted differently:
-                        #   {'type': 'relation', 'relation': [{'id': '<page_id>'}]}
-                        # 'Corrections': notion_rich_text(', '.join(data.corrections)),
-                        'FR Citation': notion_rich_text(data.fr_citation),
-                        'FR Topics': {
-                            'type': 'multi_select',
-                            'multi_select': [
-                                {'name': re.sub(r', ', ' and ', topic)}
-                                for topic in data.fr_topics
-                            ]
-                        },
-                        'FR Document Number': notion_rich_text(data.fr_document_number),
-                        'FR PDF': {
-                            'url': data.fr_pdf
-                        },
-                        'Docket Documents': {
-                            'type': 'rich_text',
-                            'rich_text': notion_rich_text_url_list(
-                                (d.id, d.url)
-                                for d in data.docket_documents
-                            )
-                        },
-                        'Docket Keywords': {
-                            'type': 'multi_select',
-                            'multi_select': [
-                                {'name': keyword}
-                                for keyword in keywords
-                            ]
-                        },
-                        'FR Publication Date': {
-                            'type': 'date',
-                            'date': {
-                                'start': data.fr_publication_date.isoformat()
-                            } if data.fr_publication_date else None
-                        },
-                        'Dockets': {
-                            'type': 'rich_text',
-                            'rich_text': notion_rich_text_url_list(
-                                (d.id, d.url)
-                                for d in sorted(dockets, key=lambda d: d.id)
+                # Notion can't handle commas in multi-select options.
+                topic_options = [{'name': topic.replace(', ', ' and ')} for topic in data.fr_topics]
+                keyword_options = [{'name': keyword} for keyword in keywords]
+                agency_options = [
+                    {'name': (
+                        ' - '.join(part.strip() for part in agency.name.split(','))
+                        if ',' in agency.name
+                        else agency.name
+                    )}
+                    for agency in data.agencies
+                ]
+
+                return {
+                    # Corrections are now relations and need to be
+                    # formatted differently:
+                    #   {'type': 'relation', 'relation': [{'id': '<page_id>'}]}
+                    # 'Corrections': notion_rich_text(', '.join(data.corrections)),
+                    'FR Citation': notion_rich_text(data.fr_citation),
+                    'FR Topics': {
+                        'type': 'multi_select',
+                        'multi_select': topic_options
+                    },
+                    'FR Document Number': notion_rich_text(data.fr_document_number),
+                    'FR PDF': {
+                        'url': data.fr_pdf
+                    },
+                    'Docket Documents': {
+                        'type': 'rich_text',
+                        'rich_text': notion_rich_text_url_list(
+                            (d.id, d.url)
+                            for d in data.docket_documents
+                        )
+                    },
+                    'Docket Keywords': {
+                        'type': 'multi_select',
+                        'multi_select': keyword_options
+                    },
+                    'FR Publication Date': {
+                        'type': 'date',
+                        'date': {
+                            'start': data.fr_publication_date.isoformat()
+                        } if data.fr_publication_date else None
+                    },
+                    'Dockets': {
+                        'type': 'rich_text',
+                        'rich_text': notion_rich_text_url_list(
+                            (d.id, d.url)
+                            for d in sorted(dockets, key=lambda d: d.id)
+                        )
+                    },
+                    'RINs': notion_rich_text(', '.join(data.rins)),
+                    'Abstract': notion_rich_text(data.abstract),
+                    'Rule Name': notion_rich_text(data.title),
+                    'Title': {
+                        'type': 'title',
+                        'title': [notion_text(data.title)]
+                    },
+                    'Authority': notion_rich_text(authority_string),
+                    'Agencies': {
+                        'type': 'multi_select',
+                        'multi_select': agency_options
+                    },
+                    'Comment End Date': {
+                        'type': 'date',
+                        'date': {
+                            'start': comment_end.isoformat()
+                        } if comment_end else None
+                    },
+                    'FR Link': {
+                        'url': data.fr_html
+                    },
+                    # Combined list of FR topics and Docket keywords.
+                    'Tags': {
+                        'type': 'multi_select',
+                        'multi_select': topic_options + keyword_options
+                    },
+                    'Action': notion_rich_text(data.action),
+                    'Correction of ID': {
+                        'type': 'rich_text',
+                        'rich_text': [
+                            notion_text(
+                                text=data.correction_of,
+                                link=f'https://www.federalregister.gov/d/{data.correction_of}',
                             )
-                        },
-                        'RINs': notion_rich_text(', '.join(data.rins)),
-                        'Abstract': notion_rich_text(data.abstract),
-                        'Rule Name': notion_rich_text(data.title),
-                        'Title': {
-                            'type': 'title',
-                            'title': [notion_text(data.title)]
-                        },
-                        'Authority': notion_rich_text(authority_string),
-                        'Agencies': {
-                            'type': 'multi_select',
-                            'multi_select': [
-                                {'name': re.sub(r'\s*,\s*', ' - ', agency.name)}
-                                for agency in data.agencies
-                            ]
-                        },
-                        'Comment End Date': {
-                            'type': 'date',
-                            'date': {
-                                'start': comment_end.isoformat()
-                            } if comment_end else None
-                        },
-                        'FR Link': {
-                            'url': data.fr_html
-                        },
-                        # Combined list of FR topics and Docket keywords.
-                        'Tags': {
-                            'type': 'multi_select',
-                            'multi_select': [
-                                {'name': re.sub(r', ', ' and ', topic)}
-                                for topic in (*data.fr_topics, *keywords,)
-                            ]
-                        },
-                        'Action': notion_rich_text(data.action),
-                        'Correction of ID': {
-                            'type': 'rich_text',
-                            'rich_text': [
-                                notion_text(
-                                    text=data.correction_of,
-                                    link=f'https://www.federalregister.gov/d/{data.correction_of}',
-                                )
-                            ] if data.correction_of else []
-                        },
-                        'Docket Doc Subtypes': notion_rich_text(', '.join(
-                            sorted(set(d.subtype for d in data.docket_documents if d.subtype))
-                        )),
-                        'Docket Subtypes': notion_rich_text(', '.join(
-                            sorted(set(itertools.chain(
-                                *(d.subtypes for d in dockets)
-                            )))
-                        )),
-                        'Docket Categories': notion_rich_text(', '.join(
-                            sorted(d.category for d in dockets if d.category)
-                        )),
-                    })
+                        ] if data.correction_of else []
+                    },
+                    'Docket Doc Subtypes': notion_rich_text(', '.join(
+                        sorted(set(d.subtype for d in data.docket_documents if d.subtype))
+                    )),
+                    'Docket Subtypes': notion_rich_text(', '.join(
+                        sorted(set(itertools.chain(
+                            *(d.subtypes for d in dockets)
+                        )))
+                    )),
+                    'Docket Categories': notion_rich_text(', '.join(
+                        sorted(d.category for d in dockets if d.category)
+                    )),
+                }
+
+            semaphore = asyncio.Semaphore(RULE_CONCURRENCY)
+
+            async def process_rule_bounded(rule: dict) -> None:
+                async with semaphore:
+                    properties = await process_rule(rule)
+
+                # Inserts wait on Notion's rate limit, so do them outside the
+                # semaphore and let other rules keep fetching in the meantime.
+                await notion.insert_into_db(NOTION_RULE_DATABASE, properties)
+
+            # If any rule fails, the task group cancels the rest before the
+            # clients they are using get closed.
+            async with asyncio.TaskGroup() as tasks:
+                async for rule in register.get_recent_proposed_rules(from_date=from_date):
+                    # The listing already has each rule's document number, so
+                    # skip the ones we know about before making any requests.
+                    if rule['document_number'] not in already_in_notion:
+                        tasks.create_task(process_rule_bounded(rule))
 
     print('Done!')
 
 
 def notion_rich_text(text: str | None) -> dict:
-    segments = []
-    if text:
-        segment_length = 2000
-        max_segments = 100
+    # Notion limits text segments to 2,000 characters and 100 segments.
+    segment_length = 2000
+    max_segments = 100
+    if not text:
         segments = []
-        remainder = text
-        while remainder and len(segments) < max_segments:
-            segments.append(notion_text(remainder[:segment_length]))
-            remainder = remainder[segment_length:]
+    elif len(text) <= segment_length:
+        segments = [notion_text(text)]
+    else:
+        segments = [
+            notion_text(text[start:start + segment_length])
+            for start in range(0, min(len(text), segment_length * max_segments), segment_length)
+        ]
 
     return {
         'type': 'rich_text',
@@ -670,15 +1101,12 @@ def notion_text(text: str, link: str | None = None) -> dict:
 
 
 def notion_rich_text_url_list(items: Iterable[tuple[str, str]]) -> list[dict]:
-    result = []
-    for index, item in enumerate(items):
-        if index > 0:
-            result.append(notion_text(', '))
-
-        result.append(notion_text(item[0], item[1]))
-
-    return result
+    # The separator is only ever serialized, so every gap can share one dict.
+    separator = notion_text(', ')
+    texts = [notion_text(text, link) for text, link in items]
+    result = list(itertools.chain.from_iterable(zip(itertools.repeat(separator), texts)))
+    return result[1:]
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,14 +1,16 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
-from os import getenv
 from rule_scout import (
+    NOTION_API_KEY,
     NOTION_RULE_DATABASE,
-    Docket,
+    REGULATIONS_GOV_API_KEY,
+    AsyncTokenBucket,
     NotionApi,
     RegulationsGovApi,
+    check_environment,
     notion_rich_text,
     notion_rich_text_url_list,
 )
-import time
 from typing import Any
 
 
@@ -20,99 +22,116 @@ ALWAYS_UPDATE_DOCKET_DATA = False
 # https://api.data.gov/docs/developer-manual/
 REGULATIONS_GOV_REQUEST_INTERVAL = 3.6
 
-# TODO: consider how to better implement this. The easy thing is to put
-# @lru_cache on the RegulationsGovApi.get_docket method, but that could
-# introduce problems if the way we use it changes.
-DOCKET_CACHE: dict[str, Docket] = {}
-
-
-def parse_rich_text_list(notion_object: dict) -> list[str]:
+# How many pages to check at once. Requests to regulations.gov are still
+# limited to one every REGULATIONS_GOV_REQUEST_INTERVAL seconds, but this lets
+# Notion updates and processing overlap with them.
+PAGE_CONCURRENCY = 10
+
+# The only page properties get_page_updates() reads. Queries only return these,
+# so anything it reads needs to be listed here.
+PAGE_PROPERTIES = [
+    'FR Document Number',
+    'FR Publication Date',
+    'Comment End Date',
+    'Docket Documents',
+    'Dockets',
+    'Docket Keywords',
+    'FR Topics',
+    'RINs',
+    'Tags',
+]
+
+
+def parse_rich_text_set(notion_object: dict) -> set[str]:
     text = NotionApi.cell_as_text(notion_object)
     if text:
-        return [item.strip() for item in text.split(',')]
+        return {item.strip() for item in text.split(',')}
     else:
-        return []
+        return set()
 
 
 def parse_multiselect_set(notion_object: dict) -> set[str]:
     if 'multi_select' not in notion_object:
         raise TypeError(f'Object is not a multi_select, it is "{notion_object.get('type')}"')
 
-    return set([item['name'] for item in notion_object['multi_select']])
+    return {item['name'] for item in notion_object['multi_select']}
 
 
-def get_page_updates(regulations_gov: RegulationsGovApi, page: dict) -> dict[str, Any]:
+async def get_page_updates(regulations_gov: RegulationsGovApi, page: dict) -> dict[str, Any]:
     updates = {}
 
     fr_number = NotionApi.cell_as_text(page['properties']['FR Document Number'])
     fr_date = NotionApi.cell_as_datetime(page['properties']['FR Publication Date'])
-    print(f'{fr_number}: {fr_date}')
+    # Pages are checked concurrently, so collect output and print it all at
+    # once, rather than interleaved with output about other pages.
+    log = [f'{fr_number}: {fr_date}']
 
     old_comment_deadline_iso = page['properties'].get('Comment End Date')
     old_comment_deadline = NotionApi.cell_as_datetime(old_comment_deadline_iso) if old_comment_deadline_iso else None
 
-    old_docket_docs = parse_rich_text_list(page['properties']['Docket Documents'])
-    old_dockets = parse_rich_text_list(page['properties']['Dockets'])
+    old_docket_docs = parse_rich_text_set(page['properties']['Docket Documents'])
+    old_dockets = parse_rich_text_set(page['properties']['Dockets'])
 
-    time.sleep(REGULATIONS_GOV_REQUEST_INTERVAL)
-    doc_infos = regulations_gov.find_documents_by_register_id(fr_number)
-    found_docs = []
-    found_dockets = []
-    latest_comment_date = old_comment_deadline
+    doc_infos = await regulations_gov.find_documents_by_register_id(fr_number)
+    found_docs = set()
+    found_dockets = set()
+    comment_dates = [old_comment_deadline] if old_comment_deadline else []
     for found in doc_infos:
         found_id = found['id']
-        found_docs.append(found_id)
+        found_docs.add(found_id)
         found_docket = found['attributes']['docketId']
         if found_docket:
-            found_dockets.append(found_docket)
+            found_dockets.add(found_docket)
         if found['attributes']['commentEndDate']:
             found_comment_date = datetime.fromisoformat(found['attributes']['commentEndDate'])
+            # Regulations.gov dates are UTC. (`astimezone()` would treat a
+            # naive date as local time instead.)
             if not found_comment_date.tzinfo:
-                found_comment_date = found_comment_date.astimezone(timezone.utc)
+                found_comment_date = found_comment_date.replace(tzinfo=timezone.utc)
             # Notion dates only have minute-level precision.
-            found_comment_date = found_comment_date.replace(second=0, microsecond=0)
-            if (not latest_comment_date) or found_comment_date > latest_comment_date:
-                latest_comment_date = found_comment_date
+            comment_dates.append(found_comment_date.replace(second=0, microsecond=0))
 
-    if set(old_docket_docs) != set(found_docs):
-        print(f'  Docket Docs (Old): {sorted(old_docket_docs)}')
-        print(f'              (New): {sorted(found_docs)}')
+    latest_comment_date = max(comment_dates, default=None)
+
+    if old_docket_docs != found_docs:
+        sorted_docs = sorted(found_docs)
+        log.append(f'  Docket Docs (Old): {sorted(old_docket_docs)}')
+        log.append(f'              (New): {sorted_docs}')
         updates['Docket Documents'] = {
             'type': 'rich_text',
             'rich_text': notion_rich_text_url_list(
                 (d, f'https://www.regulations.gov/document/{d}')
-                for d in sorted(found_docs)
+                for d in sorted_docs
             )
         }
-    if set(old_dockets) != set(found_dockets):
-        print(f'  Dockets (Old): {sorted(old_dockets)}')
-        print(f'          (New): {sorted(found_dockets)}')
+    if old_dockets != found_dockets:
+        sorted_dockets = sorted(found_dockets)
+        log.append(f'  Dockets (Old): {sorted(old_dockets)}')
+        log.append(f'          (New): {sorted_dockets}')
         updates['Dockets'] = {
             'type': 'rich_text',
             'rich_text': notion_rich_text_url_list(
                 (d, f'https://www.regulations.gov/docket/{d}')
-                for d in sorted(found_dockets)
+                for d in sorted_dockets
             )
         }
 
     if ALWAYS_UPDATE_DOCKET_DATA or 'Dockets' in updates:
         new_keywords = set()
         new_rins = set()
-        for docket_id in found_dockets:
-            docket = DOCKET_CACHE.get(docket_id)
-            if not docket:
-                time.sleep(REGULATIONS_GOV_REQUEST_INTERVAL)
-                docket = regulations_gov.get_docket_object(docket_id, if_missing='hidden')
-                DOCKET_CACHE[docket_id] = docket
-
+        dockets = await asyncio.gather(*(
+            regulations_gov.get_docket_object(docket_id, if_missing='hidden')
+            for docket_id in found_dockets
+        ))
+        for docket in dockets:
             new_keywords.update(docket.keywords)
             if docket.rin:
                 new_rins.add(docket.rin)
 
         old_keywords = parse_multiselect_set(page['properties']['Docket Keywords'])
         if old_keywords != new_keywords:
-            print(f'  KW (old): {sorted(old_keywords)}')
-            print(f'     (new): {sorted(new_keywords)}')
+            log.append(f'  KW (old): {sorted(old_keywords)}')
+            log.append(f'     (new): {sorted(new_keywords)}')
             updates['Docket Keywords'] = {
                 'type': 'multi_select',
                 'multi_select': [
@@ -121,21 +140,24 @@ def get_page_updates(regulations_gov: RegulationsGovApi, page: dict) -> dict[str
                 ]
             }
 
-            fr_topics = parse_multiselect_set(page['properties']['FR Topics'])
-            updates['Tags'] = {
-                'type': 'multi_select',
-                'multi_select': [
-                    {'name': tag}
-                    for tag in sorted([*fr_topics, *new_keywords])
-                ]
-            }
+            # Tags may already be right even if the keywords changed (e.g. a
+            # keyword that is also an FR topic), so don't send them if not.
+            new_tags = parse_multiselect_set(page['properties']['FR Topics']) | new_keywords
+            if new_tags != parse_multiselect_set(page['properties']['Tags']):
+                updates['Tags'] = {
+                    'type': 'multi_select',
+                    'multi_select': [
+                        {'name': tag}
+                        for tag in sorted(new_tags)
+                    ]
+                }
 
         # RINs are a little complicated; they belong to Dockets, but sometimes
         # a document on regulations.gov does not have a user-visible docket.
         # The correct RINs are often listed on the Federal Register, which we
         # don't re-query here, so we only add to the list of known RINs and
         # never remove.
-        old_rins = set(parse_rich_text_list(page['properties']['RINs']))
+        old_rins = parse_rich_text_set(page['properties']['RINs'])
         # TODO: remove this old "Not Assigned" check after remediating old
         # data. These always should have been skipped and this is here to help
         # clear them out.
@@ -145,12 +167,12 @@ def get_page_updates(regulations_gov: RegulationsGovApi, page: dict) -> dict[str
                 for rin in old_rins
                 if rin.lower() != 'not assigned'
             ])
-            print(f'  RIN (old): {sorted(old_rins)}')
-            print(f'      (new): {sorted(new_rins)}')
+            log.append(f'  RIN (old): {sorted(old_rins)}')
+            log.append(f'      (new): {sorted(new_rins)}')
             updates['RINs'] = notion_rich_text(', '.join(sorted(new_rins)))
 
     if old_comment_deadline != latest_comment_date:
-        print(f'  New comment deadline: {latest_comment_date} (old: {old_comment_deadline})')
+        log.append(f'  New comment deadline: {latest_comment_date} (old: {old_comment_deadline})')
         updates['Comment End Date'] = {
             'type': 'date',
             'date': {
@@ -158,15 +180,21 @@ def get_page_updates(regulations_gov: RegulationsGovApi, page: dict) -> dict[str
             } if latest_comment_date else None
         }
 
+    print('\n'.join(log))
     return updates
 
 
-def main() -> None:
+async def main() -> None:
     COMMIT = True
     DEBUG = True
 
-    with NotionApi(getenv('NOTION_API_KEY')) as notion:
-        with RegulationsGovApi(getenv(key='REGULATIONS_GOV_API_KEY')) as regulations_gov:
+    check_environment()
+
+    async with NotionApi(NOTION_API_KEY) as notion:
+        async with RegulationsGovApi(
+            REGULATIONS_GOV_API_KEY,
+            rate_limit=AsyncTokenBucket(rate=1 / REGULATIONS_GOV_REQUEST_INTERVAL),
+        ) as regulations_gov:
             active_as_of_date = (datetime.now(tz=timezone.utc) - timedelta(days=14)).isoformat()
             rule_rows = notion.query_db(
                 NOTION_RULE_DATABASE,
@@ -196,17 +224,29 @@ def main() -> None:
                         }
                     ]
                 },
+                select=PAGE_PROPERTIES,
                 sort={'FR Publication Date': 'ascending'}
             )
 
-            for page in rule_rows:
-                updates = get_page_updates(regulations_gov, page)
+            semaphore = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+            async def process_page(page: dict) -> None:
+                async with semaphore:
+                    updates = await get_page_updates(regulations_gov, page)
+
                 if updates:
                     if DEBUG:
                         print(f'  Updates: {updates}')
                     if COMMIT:
-                        notion.update_page(page['id'], updates)
+                        await notion.update_page(page['id'], updates)
+
+            # Start on each page as soon as it arrives, rather than waiting for
+            # the whole query. If any page fails, the task group cancels the
+            # rest before the clients they are using get closed.
+            async with asyncio.TaskGroup() as tasks:
+                async for page in rule_rows:
+                    tasks.create_task(process_page(page))
 
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())